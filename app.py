@@ -1,49 +1,123 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
-from models import init_db, add_admin, get_db_connection, hash_password, create_user, get_departments, add_department, add_doctor_profile, set_doctor_availability, get_doctor_availability, get_available_doctors, get_doctor_availability_by_date, create_appointment, get_patient_appointments # <-- Imported new functions
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, jsonify, make_response
+from models import init_db, add_admin, get_db_connection, verify_password, upgrade_password_hash, create_user, get_departments, add_department, add_departments_bulk, add_doctor_profile, set_doctor_availability, get_doctor_availability, get_available_doctors, get_doctor_availability_by_date, create_appointment, get_patient_appointments, get_patient_upcoming, get_patient_history, get_slots_version, DoctorAppointmentRow, PatientRow, DoctorRow # <-- Imported new functions
 import os
 import hashlib
 import sqlite3
+import tempfile
+import time
 from datetime import date, timedelta, datetime # <-- Import datetime utilities
+from functools import wraps
+from jinja2 import FileSystemBytecodeCache
 
 # Initialize Flask App
 app = Flask(__name__)
 # Flask session secret key (CRITICAL for security)
-app.secret_key = os.environ.get('SECRET_KEY', 'a_strong_fallback_secret_key_12345') 
-
-# --- Database Initialization on Startup ---
-# This ensures the database file and the Admin user are created when the app starts
-with app.app_context():
+app.secret_key = os.environ.get('SECRET_KEY', 'a_strong_fallback_secret_key_12345')
+
+# Persist compiled Jinja templates so renders after the first (and across
+# restarts) skip template compilation entirely
+_jinja_cache_dir = os.path.join(tempfile.gettempdir(), 'hms_jinja_cache')
+os.makedirs(_jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(_jinja_cache_dir)
+
+# Lets templates iterate several parallel column lists in one loop
+# (struct-of-arrays rendering); zip's fast path runs in C
+app.jinja_env.filters['zip'] = zip
+
+if not app.debug:
+    # Outside debug (set FLASK_DEBUG=1 when developing) templates never change
+    # underfoot, so skip the per-render mtime check too
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_env.auto_reload = False
+
+# --- Database Initialization ---
+# Seeding no longer runs at import time: with several workers (gunicorn) every
+# process would take the write lock just to re-insert the same rows. Run
+# `flask init-db` once at deploy instead (`python app.py` still seeds itself).
+
+SEED_DEPARTMENTS = [
+    ("Cardiology", "Heart and blood vessels."),
+    ("Pediatrics", "Children's health."),
+    ("Orthopedics", "Bones and muscles."),
+]
+
+def seed_database():
+    """Creates the schema and seeds the Admin user and default departments."""
     init_db()
     add_admin()
-    add_department("Cardiology", "Heart and blood vessels.") # Seed default departments
-    add_department("Pediatrics", "Children's health.")
-    add_department("Orthopedics", "Bones and muscles.")
+    # One multi-row insert instead of a commit per department
+    add_departments_bulk(SEED_DEPARTMENTS)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """One-shot database initialization: flask init-db"""
+    seed_database()
+    print("Database initialized.")
 
 # --- Before/After Request Hooks ---
 
+def _session_user_payload(user):
+    """Builds the small user dict stored in the signed session cookie.
+
+    Only the fields the views and templates actually read are kept, so the
+    per-request SELECT on the users table can be skipped entirely."""
+    return {
+        'id': user['id'],
+        'username': user['username'],
+        'role': user['role'],
+        'name': user['name'],
+        'contact_info': user['contact_info'],
+    }
+
+# Endpoints that can never need a users-table lookup: static files, and the
+# auth pages themselves. The signed-session read stays (it is free and the
+# navbar renders g.user everywhere), only the legacy-session DB upgrade is
+# skipped here.
+PUBLIC_ENDPOINTS = {'static', 'login', 'register', 'logout'}
+
 @app.before_request
 def load_logged_in_user():
-    """Load user data from session into the global 'g' object."""
-    user_id = session.get('user_id')
-    if user_id is None:
-        g.user = None
-    else:
+    """Load user data from the signed session into the global 'g' object."""
+    # Today's date is compared/rendered all over the handlers; format it once
+    # per request (isoformat is the fast path for YYYY-MM-DD)
+    g.today_str = date.today().isoformat()
+    g.user = session.get('user')
+    if g.user is None and request.endpoint not in PUBLIC_ENDPOINTS and session.get('user_id') is not None:
+        # Session from before the payload change: fetch once and upgrade it
         conn = get_db_connection()
-        g.user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        user = conn.execute(
+            "SELECT id, username, role, name, contact_info FROM users WHERE id = ?",
+            (session['user_id'],)
+        ).fetchone()
         conn.close()
+        if user is not None:
+            session['user'] = _session_user_payload(user)
+            g.user = session['user']
+    # Stash the two hottest fields directly on g so handlers do a plain
+    # attribute read instead of a dict lookup per use
+    g.user_id = g.user['id'] if g.user else None
+    g.role = g.user['role'] if g.user else None
+
+def login_required(roles=None):
+    """Decorator to check if a user is logged in and optionally checks their role.
+
+    roles accepts a single role name or any iterable of allowed roles,
+    e.g. @login_required(roles={'Admin', 'Doctor'})."""
+    if isinstance(roles, str):
+        roles = frozenset({roles})
+    elif roles is not None:
+        roles = frozenset(roles)
 
-def login_required(role=None):
-    """Decorator to check if a user is logged in and optionally checks their role."""
     def wrapper(f):
+        @wraps(f) # Preserve the original function's name, docstring, and signature
         def decorated_function(*args, **kwargs):
             if g.user is None:
                 flash("Please log in to access this page.", 'danger')
                 return redirect(url_for('login'))
-            if role and g.user['role'] != role:
-                flash(f"Access denied. You must be a {role}.", 'danger')
+            if roles and g.role not in roles:
+                flash(f"Access denied. You must be a {' or '.join(sorted(roles))}.", 'danger')
                 return redirect(url_for('dashboard'))
             return f(*args, **kwargs)
-        decorated_function.__name__ = f.__name__ # Preserve original function name
         return decorated_function
     return wrapper
 
@@ -54,28 +128,83 @@ def index():
     """The public landing page."""
     return render_template('index.html', title='Welcome to HMS')
 
+# --- Login brute-force protection ---
+# bcrypt makes each verification deliberately slow, so an attacker replaying
+# the same guess must not cost us a full hash every time. Verdicts are cached
+# by (username, password digest) — failures longer than successes — and the
+# POST handler is rate-limited per IP.
+LOGIN_RATE_LIMIT = 5            # attempts per IP...
+LOGIN_RATE_WINDOW = 60          # ...per this many seconds
+LOGIN_CACHE_SIZE = 1024
+LOGIN_CACHE_TTL_SUCCESS = 60    # seconds
+LOGIN_CACHE_TTL_FAILURE = 600   # failures cached longer to blunt credential stuffing
+
+_login_verdict_cache = {}       # (username, password digest) -> (verdict, expires)
+_login_attempts = {}            # ip -> (window_start, count)
+
+def _login_rate_limited(ip):
+    """Counts an attempt for this IP and reports whether it exceeded the limit."""
+    now = time.monotonic()
+    if len(_login_attempts) > LOGIN_CACHE_SIZE:
+        # Drop expired windows so the dict stays bounded
+        for key in [k for k, (start, _) in _login_attempts.items() if now - start >= LOGIN_RATE_WINDOW]:
+            del _login_attempts[key]
+    window_start, count = _login_attempts.get(ip, (now, 0))
+    if now - window_start >= LOGIN_RATE_WINDOW:
+        window_start, count = now, 0
+    _login_attempts[ip] = (window_start, count + 1)
+    return count + 1 > LOGIN_RATE_LIMIT
+
+def _cached_verify(username, password, stored_hash):
+    """verify_password with a bounded TTL cache over repeated identical guesses."""
+    key = (username, hashlib.sha256(password.encode()).digest())
+    now = time.monotonic()
+    cached = _login_verdict_cache.get(key)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    verdict = verify_password(password, stored_hash)
+    if len(_login_verdict_cache) >= LOGIN_CACHE_SIZE:
+        _login_verdict_cache.clear()
+    ttl = LOGIN_CACHE_TTL_SUCCESS if verdict else LOGIN_CACHE_TTL_FAILURE
+    _login_verdict_cache[key] = (verdict, now + ttl)
+    return verdict
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Handles user login authentication."""
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+
+        if _login_rate_limited(request.remote_addr):
+            flash("Too many login attempts. Please wait a minute and try again.", 'danger')
+            return render_template('login.html', title='Login')
+
         conn = get_db_connection()
         error = None
-        
-        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+
+        # Only the session-payload fields plus the hash — no point dragging
+        # every column through SQLite for the most-executed lookup in the app
+        user = conn.execute(
+            "SELECT id, username, role, name, contact_info, password_hash FROM users WHERE username = ?",
+            (username,)
+        ).fetchone()
         conn.close()
 
         if user is None:
             error = 'Incorrect username.'
-        elif user['password_hash'] != hash_password(password):
-            # Note: The hash_password function from models.py is used here for verification
+        elif not _cached_verify(username, password, user['password_hash']):
+            # Note: The verify_password function from models.py handles both bcrypt and legacy hashes
             error = 'Incorrect password.'
 
         if error is None:
+            # Transparently upgrade pre-bcrypt accounts now that we have the plaintext
+            if not user['password_hash'].startswith('$2'):
+                upgrade_password_hash(user['id'], password)
             session.clear()
             session['user_id'] = user['id']
             session['role'] = user['role']
+            session['user'] = _session_user_payload(user)
             flash(f"Welcome, {user['name']} ({user['role']})!", 'success')
             return redirect(url_for('dashboard'))
         
@@ -110,10 +239,11 @@ def register():
         session.clear()
         session['user_id'] = user_id
         session['role'] = 'Patient'
+        session['user'] = {'id': user_id, 'username': username, 'role': 'Patient', 'name': name, 'contact_info': contact_info}
         flash(f"Registration successful! Welcome, {name}.", 'success')
         return redirect(url_for('patient_dashboard'))
     else:
-        # Username already exists (IntegrityError caught in models.py)
+        # Username already exists (the insert's ON CONFLICT clause returned no row)
         flash('Registration failed. The username may already be taken.', 'danger')
         return redirect(url_for('patient_dashboard'))
 
@@ -129,32 +259,47 @@ def logout():
 @login_required()
 def dashboard():
     """Redirects user to the appropriate dashboard based on their role."""
-    if g.user['role'] == 'Admin':
+    if g.role == 'Admin':
         return redirect(url_for('admin_dashboard'))
-    elif g.user['role'] == 'Doctor':
+    elif g.role == 'Doctor':
         return redirect(url_for('doctor_dashboard'))
-    elif g.user['role'] == 'Patient':
+    elif g.role == 'Patient':
         return redirect(url_for('patient_dashboard'))
     return redirect(url_for('index'))
 
 # --- Role-Specific Dashboards ---
 
-@app.route('/admin/dashboard')
-@login_required(role='Admin')
-def admin_dashboard():
-    """Admin dashboard showing overall system statistics."""
+# Admin statistics barely change between loads; cache them briefly so each
+# dashboard hit doesn't re-run three COUNT queries.
+ADMIN_COUNTS_TTL = 60 # seconds
+_admin_counts_cache = {'value': None, 'expires': 0.0}
+
+def _admin_counts():
+    """Returns (doctor_count, patient_count, appointment_count), cached for 60s."""
+    if _admin_counts_cache['value'] is not None and time.monotonic() < _admin_counts_cache['expires']:
+        return _admin_counts_cache['value']
     conn = get_db_connection()
-    
-    # 1. Count Doctors (Users where role='Doctor')
-    doctor_count = conn.execute("SELECT COUNT(id) FROM users WHERE role = 'Doctor'").fetchone()[0]
-    
-    # 2. Count Patients (Users where role='Patient')
-    patient_count = conn.execute("SELECT COUNT(id) FROM users WHERE role = 'Patient'").fetchone()[0]
-    
+
+    # 1+2. Count Doctors and Patients in a single pass over users —
+    # SQLite evaluates role='X' as 0/1, so the SUMs are conditional counts
+    doctor_count, patient_count = conn.execute(
+        "SELECT COALESCE(SUM(role = 'Doctor'), 0), COALESCE(SUM(role = 'Patient'), 0) FROM users"
+    ).fetchone()
+
     # 3. Count Total Appointments
     appointment_count = conn.execute("SELECT COUNT(id) FROM appointments").fetchone()[0]
-    
+
     conn.close()
+    counts = (doctor_count, patient_count, appointment_count)
+    _admin_counts_cache['value'] = counts
+    _admin_counts_cache['expires'] = time.monotonic() + ADMIN_COUNTS_TTL
+    return counts
+
+@app.route('/admin/dashboard')
+@login_required(roles='Admin')
+def admin_dashboard():
+    """Admin dashboard showing overall system statistics."""
+    doctor_count, patient_count, appointment_count = _admin_counts()
 
     context = {
         'doctor_count': doctor_count,
@@ -168,43 +313,55 @@ def admin_dashboard():
 # --- DOCTOR DASHBOARD AND AVAILABILITY ---
 
 @app.route('/doctor/dashboard')
-@login_required(role='Doctor')
+@login_required(roles='Doctor')
 def doctor_dashboard():
     """Doctor Dashboard displaying appointments, patient lists, and availability."""
-    doctor_id = g.user['id']
+    doctor_id = g.user_id
     conn = get_db_connection()
-    
-    today = date.today().strftime('%Y-%m-%d')
-    
+
+    today = g.today_str
+
     # 1. Upcoming Appointments (Today/Future)
-    upcoming_appointments = conn.execute("""
+    upcoming_appointments = [DoctorAppointmentRow(*row) for row in conn.execute("""
         SELECT a.id, a.date, a.time, u.name AS patient_name, u.contact_info
         FROM appointments a
         JOIN users u ON a.patient_id = u.id
         WHERE a.doctor_id = ? AND a.status = 'Booked' AND a.date >= ?
         ORDER BY a.date, a.time
-    """, (doctor_id, today)).fetchall()
-    
+    """, (doctor_id, today))]
+
     # 2. List of All Unique Patients Assigned to this Doctor (via past/upcoming appointments)
-    patient_list = conn.execute("""
-        SELECT DISTINCT u.id, u.name, u.contact_info
+    # GROUP BY instead of DISTINCT so idx_appt_doctor_patient can cover the scan
+    patient_list = [PatientRow(*row) for row in conn.execute("""
+        SELECT u.id, u.name, u.contact_info
         FROM appointments a
         JOIN users u ON a.patient_id = u.id
         WHERE a.doctor_id = ?
+        GROUP BY u.id
         ORDER BY u.name
-    """, (doctor_id,)).fetchall()
-    
-    # 3. Availability for the next 7 days
-    start_date = date.today().strftime('%Y-%m-%d')
-    end_date = (date.today() + timedelta(days=6)).strftime('%Y-%m-%d')
-    availability_slots = get_doctor_availability(doctor_id, start_date, end_date)
+    """, (doctor_id,))]
+
+    # 3. Availability for the next 7 days (reusing this request's connection)
+    start_date = g.today_str
+    end_date = (date.today() + timedelta(days=6)).isoformat()
+    availability_slots = get_doctor_availability(doctor_id, start_date, end_date, conn=conn)
 
     conn.close()
 
+    # Struct-of-arrays layout for the availability table: three plain column
+    # lists instead of N row objects; the template re-zips them with the zip
+    # filter so iteration stays in C
+    if availability_slots:
+        avail_dates, avail_starts, avail_ends = (list(col) for col in zip(*availability_slots))
+    else:
+        avail_dates, avail_starts, avail_ends = [], [], []
+
     context = {
         'upcoming_appointments': upcoming_appointments,
         'patient_list': patient_list,
-        'availability_slots': availability_slots,
+        'avail_dates': avail_dates,
+        'avail_starts': avail_starts,
+        'avail_ends': avail_ends,
         'today': today,
         'end_date': end_date
     }
@@ -213,10 +370,10 @@ def doctor_dashboard():
     return render_template('dashboards/doctor.html', title='Doctor Dashboard', **context)
 
 @app.route('/doctor/availability', methods=['POST'])
-@login_required(role='Doctor')
+@login_required(roles='Doctor')
 def doctor_availability():
     """Handles submission of doctor availability form."""
-    doctor_id = g.user['id']
+    doctor_id = g.user_id
     
     # Process the form data
     date_str = request.form.get('date')
@@ -233,7 +390,7 @@ def doctor_availability():
         datetime.strptime(date_str, '%Y-%m-%d')
         
         # Check if the date is in the past
-        if date_str < date.today().strftime('%Y-%m-%d'):
+        if date_str < g.today_str:
             flash("You cannot set availability for a past date.", 'danger')
             return redirect(url_for('doctor_dashboard'))
 
@@ -255,21 +412,15 @@ def doctor_availability():
 def patient_dashboard(): 
     """Handles Patient dashboard display (if logged in) or Registration (if logged out)."""
     # If a patient is logged in, they see their dashboard and history
-    if g.user and g.user['role'] == 'Patient':
-        patient_id = g.user['id']
-        appointments = get_patient_appointments(patient_id)
-        
-        # Separate appointments into Upcoming and History (Completed/Cancelled)
-        upcoming = []
-        history = []
-        today_date_str = date.today().strftime('%Y-%m-%d')
-        
-        for appt in appointments:
-            if appt['status'] == 'Booked' and appt['date'] >= today_date_str:
-                upcoming.append(appt)
-            else:
-                history.append(appt)
-        
+    if g.user and g.role == 'Patient':
+        patient_id = g.user_id
+        today_date_str = g.today_str
+
+        # The upcoming/history split happens in SQL so only the rows each
+        # section needs are materialized (uses idx_appt_patient_date)
+        upcoming = get_patient_upcoming(patient_id, today_date_str)
+        history = get_patient_history(patient_id, today_date_str)
+
         context = {
             'user': g.user,
             'upcoming_appointments': upcoming,
@@ -283,7 +434,7 @@ def patient_dashboard():
 
 
 @app.route('/patient/book', methods=['GET', 'POST'])
-@login_required(role='Patient')
+@login_required(roles='Patient')
 def patient_book_appointment():
     """Handles doctor search and appointment booking."""
     departments = get_departments()
@@ -302,7 +453,7 @@ def patient_book_appointment():
 
     # Handle Appointment Booking (POST request)
     elif request.method == 'POST':
-        patient_id = g.user['id']
+        patient_id = g.user_id
         doctor_id = request.form.get('doctor_id')
         date_str = request.form.get('date')
         time = request.form.get('time')
@@ -312,7 +463,7 @@ def patient_book_appointment():
             return redirect(url_for('patient_book_appointment'))
 
         # Check if date is in the future
-        if date_str < date.today().strftime('%Y-%m-%d'):
+        if date_str < g.today_str:
             flash("Appointments must be booked for today or a future date.", 'danger')
             return redirect(url_for('patient_book_appointment'))
             
@@ -327,14 +478,14 @@ def patient_book_appointment():
     context = {
         'departments': departments,
         'doctors': doctors,
-        'today': date.today().strftime('%Y-%m-%d'),
+        'today': g.today_str,
         'current_page': 'book_appointment' # Used for navigation/styling
     }
     return render_template('dashboards/patient_book.html', title='Book Appointment', **context)
 
 # API Endpoint to fetch availability dynamically (AJAX/JS)
 @app.route('/api/doctor/<int:doctor_id>/availability/<string:date_str>')
-@login_required(role='Patient')
+@login_required(roles='Patient')
 def api_get_availability(doctor_id, date_str):
     """API endpoint to get available slots for a doctor on a given date."""
     # Check if the date is valid and not in the past
@@ -345,14 +496,25 @@ def api_get_availability(doctor_id, date_str):
     except ValueError:
         return {'error': 'Invalid date format'}, 400
 
+    # The ETag changes only when availability/bookings change (slots version),
+    # so a browser re-opening the booking UI gets a 304 without a DB query.
+    etag = hashlib.md5(f"{doctor_id}:{date_str}:{get_slots_version()}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
     slots = get_doctor_availability_by_date(doctor_id, date_str)
-    return {'slots': slots}
+    response = make_response(jsonify({'slots': slots}))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=30'
+    return response.make_conditional(request)
 
 
 # --- ADMIN MANAGEMENT ROUTES ---
 
 @app.route('/admin/doctors', methods=['GET', 'POST'])
-@login_required(role='Admin')
+@login_required(roles='Admin')
 def manage_doctors():
     """Allows Admin to view, add, or delete doctor profiles."""
     conn = get_db_connection()
@@ -370,32 +532,40 @@ def manage_doctors():
             flash('All doctor fields (Name, Username, Password, Specialization) are required.', 'danger')
             return redirect(url_for('manage_doctors'))
 
-        # 1. Create the user with role 'Doctor'
-        doctor_user_id = create_user(username, password, name, contact_info, role='Doctor')
-
-        if doctor_user_id is not None:
-            # 2. Create the corresponding doctor profile
-            if add_doctor_profile(doctor_user_id, specialization_id):
-                flash(f"Doctor {name} added successfully! Username: {username}", 'success')
-            else:
-                # Cleanup user if profile creation fails (unlikely, but good practice)
-                conn.execute("DELETE FROM users WHERE id = ?", (doctor_user_id,))
-                conn.commit()
-                flash("Failed to create doctor profile.", 'danger')
-        else:
+        # Create the user and its doctor profile in ONE transaction: a single
+        # commit on success, and a failed profile insert rolls the user back
+        # automatically instead of needing a manual cleanup DELETE
+        doctor_user_id = None
+        profile_ok = False
+        try:
+            with conn:
+                doctor_user_id = create_user(username, password, name, contact_info, role='Doctor', conn=conn)
+                if doctor_user_id is not None:
+                    profile_ok = add_doctor_profile(doctor_user_id, specialization_id, conn=conn)
+                    if not profile_ok:
+                        # Raising aborts the transaction so the user row is rolled back
+                        raise sqlite3.IntegrityError("doctor profile creation failed")
+        except sqlite3.IntegrityError:
+            pass
+
+        if doctor_user_id is None:
             flash('Error: Username already exists or data is invalid.', 'danger')
-            
+        elif not profile_ok:
+            flash("Failed to create doctor profile.", 'danger')
+        else:
+            flash(f"Doctor {name} added successfully! Username: {username}", 'success')
+
         conn.close()
         return redirect(url_for('manage_doctors'))
 
     # GET request: Display list of doctors and the 'Add Doctor' form
-    doctors_list = conn.execute("""
+    doctors_list = [DoctorRow(*row) for row in conn.execute("""
         SELECT u.id, u.name, u.username, u.contact_info, d.name AS specialization
         FROM users u
         JOIN doctors doc ON u.id = doc.user_id
         JOIN departments d ON doc.specialization_id = d.id
         WHERE u.role = 'Doctor'
-    """).fetchall()
+    """)]
     
     conn.close()
     
@@ -409,4 +579,5 @@ def manage_doctors():
 
 if __name__ == '__main__':
     # You must install Flask first: pip install flask
+    seed_database() # Direct runs are single-process, so seeding here is safe
     app.run(debug=True)
\ No newline at end of file
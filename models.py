@@ -1,143 +1,484 @@
 import sqlite3
 import hashlib
+import hmac
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime, timedelta # Import timedelta
 
+try:
+    import bcrypt
+except ImportError:
+    # bcrypt is optional: without it new hashes fall back to legacy SHA-256.
+    bcrypt = None
+
 # Define the path for the SQLite database file
 DATABASE = 'hms.db'
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
+# Bcrypt work factor. Tune on deploy hardware so one hash takes ~250ms.
+BCRYPT_ROUNDS = 12
+
+# --- CONNECTION POOL ---
+# Opening/closing a connection per call throws away SQLite's page cache and
+# statement cache, so we keep a bounded pool of long-lived connections instead.
+POOL_SIZE = min(32, (os.cpu_count() or 1) * 2)
+
+_pool = queue.Queue(maxsize=POOL_SIZE)
+_write_lock = threading.Lock() # Serializes writers (SQLite allows only one at a time)
+
+def _new_connection():
+    """Opens a new connection with the performance PRAGMAs applied."""
+    # cached_statements: every query here is a fixed SQL string with ?
+    # placeholders, so a bigger per-connection prepared-statement cache means
+    # each one is parsed/planned once per pooled connection, then reused
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row # Allows accessing columns by name
+    # WAL + synchronous=NORMAL turns each commit into a single WAL append (at
+    # most one fdatasync) and lets readers proceed while a writer commits
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000") # 64MB page cache
+    conn.execute("PRAGMA mmap_size=268435456") # Read pages via a 256MB mmap
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA busy_timeout=5000") # Wait out writer contention instead of erroring
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
+class _PooledConnection:
+    """Thin wrapper so close() returns the connection to the pool instead of
+    discarding it. Everything else is delegated to the real connection, which
+    keeps the existing conn.execute()/conn.commit()/conn.close() call sites working."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        try:
+            _pool.put_nowait(self._conn)
+        except queue.Full:
+            self._conn.close()
+
+def get_db_connection():
+    """Borrows a pooled connection to the SQLite database.
+
+    Calling close() on the returned object puts the connection back in the
+    pool (it does NOT close the underlying SQLite handle)."""
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _new_connection()
+    return _PooledConnection(conn)
+
+# Module-level bind of the one-shot constructor: saves the hashlib attribute
+# lookup on every call (this runs per login for legacy accounts)
+_sha256 = hashlib.sha256
+
+# hashlib hands sha256 to OpenSSL's EVP layer when the _hashlib module is
+# available; OpenSSL in turn uses the CPU's SHA extensions (SHA-NI on x86,
+# the ARMv8 crypto ones) where present. The bundled fallback module is
+# several times slower, so surface which backend this interpreter got —
+# init_db prints it so slow logins are explainable from deploy logs.
+try:
+    import _hashlib # noqa: F401 - only probed for availability
+    SHA256_BACKEND = 'openssl'
+except ImportError:
+    SHA256_BACKEND = 'builtin'
+
+def _legacy_hash_password(password):
+    """Old unsalted SHA-256 hash, kept only to verify pre-bcrypt accounts."""
+    # .digest().hex() produces the same string as hexdigest() without its
+    # extra internal allocation path
+    return _sha256(password.encode()).digest().hex()
+
 def hash_password(password):
     """Hashes a password for secure storage."""
-    # Using SHA-256 for a basic example. In a real application, use a proper library like bcrypt.
-    return hashlib.sha256(password.encode()).hexdigest()
+    if bcrypt is not None:
+        # bcrypt output embeds its own salt and cost, so it fits the existing
+        # password_hash TEXT column as-is.
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+    # Fallback when bcrypt is not installed. Unsalted and fast - install bcrypt!
+    return _legacy_hash_password(password)
+
+def verify_password(password, stored_hash):
+    """Checks a plaintext password against a stored hash.
+
+    Handles both bcrypt hashes (prefixed '$2') and legacy SHA-256 hashes, so
+    existing accounts keep working during the migration."""
+    if stored_hash.startswith('$2') and bcrypt is not None:
+        return bcrypt.checkpw(password.encode(), stored_hash.encode())
+    # compare_digest avoids the early-exit timing of a plain != (both operands
+    # are str here, keeping it on the constant-time path)
+    return hmac.compare_digest(stored_hash, _legacy_hash_password(password))
 
-def create_user(username, password, name, contact_info, role='Patient'):
-    """Inserts a new user record into the database."""
+def upgrade_password_hash(user_id, password):
+    """Re-hashes a legacy password with bcrypt after a successful login."""
+    if bcrypt is None:
+        return
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        with _write_lock, conn:
+            conn.execute(
+                "UPDATE users SET password_hash = ? WHERE id = ?",
+                (hash_password(password), user_id)
+            )
+    finally:
+        conn.close()
+
+def create_user(username, password, name, contact_info, role='Patient', conn=None):
+    """Inserts a new user record into the database.
+
+    When conn is given the insert joins the caller's open transaction: no
+    commit and no close here, so several writes can share a single commit
+    (see the doctor-creation path in manage_doctors)."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     hashed_pass = hash_password(password)
-    
+
+    # ON CONFLICT ... RETURNING reports a taken username through the result
+    # set (no row back) instead of an IntegrityError, so the collision path
+    # skips exception raising and unwinding entirely
+    sql = """INSERT INTO users (username, password_hash, role, name, contact_info)
+             VALUES (?, ?, ?, ?, ?)
+             ON CONFLICT(username) DO NOTHING
+             RETURNING id"""
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password_hash, role, name, contact_info) VALUES (?, ?, ?, ?, ?)",
-            (username, hashed_pass, role, name, contact_info)
-        )
-        user_id = cursor.lastrowid
-        conn.commit()
-        return user_id
-    except sqlite3.IntegrityError:
-        # This error is usually thrown if the username is not unique
-        return None
+        if own_conn:
+            # `with conn:` lets SQLite drive BEGIN/COMMIT itself (rollback on error)
+            with _write_lock, conn:
+                row = conn.execute(sql, (username, hashed_pass, role, name, contact_info)).fetchone()
+        else:
+            row = conn.execute(sql, (username, hashed_pass, role, name, contact_info)).fetchone()
+        return row[0] if row is not None else None
+    finally:
+        if own_conn:
+            conn.close()
+
+def create_users_bulk(users):
+    """Inserts many users in one transaction.
+
+    users is a list of (username, password, name, contact_info, role) tuples.
+    executemany reuses one prepared statement and the whole batch shares a
+    single commit (one fsync instead of one per user). Duplicate usernames
+    are skipped. Returns the number of rows inserted."""
+    rows = [
+        (username, hash_password(password), role, name, contact_info)
+        for username, password, name, contact_info, role in users
+    ]
+    conn = get_db_connection()
+    try:
+        with _write_lock, conn:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO users (username, password_hash, role, name, contact_info) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            return cursor.rowcount
     finally:
         conn.close()
 
 # --- DOCTOR MANAGEMENT FUNCTIONS ---
 
+# Departments change rarely (admin adds one) but are read on every booking
+# page, so the list is cached in-process and invalidated on writes.
+DEPARTMENTS_CACHE_TTL = 300 # seconds
+
+_departments_cache = {'rows': None, 'expires': 0.0}
+
+def _invalidate_departments_cache():
+    _departments_cache['expires'] = 0.0
+
 def add_department(name, description):
     """Adds a specialization/department if it doesn't already exist."""
     conn = get_db_connection()
     try:
-        conn.execute("INSERT OR IGNORE INTO departments (name, description) VALUES (?, ?)", (name, description))
-        conn.commit()
+        with _write_lock, conn:
+            conn.execute("INSERT OR IGNORE INTO departments (name, description) VALUES (?, ?)", (name, description))
+        _invalidate_departments_cache()
+    finally:
+        conn.close()
+
+def add_departments_bulk(departments):
+    """Adds many (name, description) departments in one statement.
+
+    A single multi-row VALUES insert compiles once and writes the whole
+    batch in one statement execution, where executemany still steps the
+    statement once per row. Seed lists are small, so the generated SQL
+    stays well under SQLite's bound-parameter limit."""
+    if not departments:
+        return
+    sql = ("INSERT OR IGNORE INTO departments (name, description) VALUES "
+           + ",".join(["(?, ?)"] * len(departments)))
+    flat = [value for row in departments for value in row]
+    conn = get_db_connection()
+    try:
+        with _write_lock, conn:
+            conn.execute(sql, flat)
+        _invalidate_departments_cache()
     finally:
         conn.close()
 
 def get_departments():
-    """Fetches all departments from the database."""
+    """Fetches all departments, served from a short-lived in-process cache."""
+    if _departments_cache['rows'] is not None and time.monotonic() < _departments_cache['expires']:
+        return _departments_cache['rows']
     conn = get_db_connection()
-    # Also count active doctors in each department
+    # doctor_count is maintained by the doctors_ai/ad/au triggers, so this
+    # is a plain scan of the departments table - no join, no aggregation
     departments = conn.execute("""
-        SELECT 
-            d.id, 
-            d.name,
-            COUNT(doc.user_id) AS doctor_count
-        FROM departments d
-        LEFT JOIN doctors doc ON d.id = doc.specialization_id
-        GROUP BY d.id, d.name
-        ORDER BY d.name
+        SELECT id, name, doctor_count
+        FROM departments
+        ORDER BY name
     """).fetchall()
     conn.close()
+    _departments_cache['rows'] = departments
+    _departments_cache['expires'] = time.monotonic() + DEPARTMENTS_CACHE_TTL
     return departments
 
-def add_doctor_profile(user_id, specialization_id):
-    """Links a Doctor user to a specialization profile."""
-    conn = get_db_connection()
+def add_doctor_profile(user_id, specialization_id, conn=None):
+    """Links a Doctor user to a specialization profile.
+
+    As with create_user, passing conn joins the caller's transaction."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    sql = """INSERT INTO doctors (user_id, specialization_id) VALUES (?, ?)
+             ON CONFLICT(user_id) DO NOTHING
+             RETURNING user_id"""
     try:
-        conn.execute(
-            "INSERT INTO doctors (user_id, specialization_id) VALUES (?, ?)",
-            (user_id, specialization_id)
-        )
-        conn.commit()
+        if own_conn:
+            with _write_lock, conn:
+                row = conn.execute(sql, (user_id, specialization_id)).fetchone()
+        else:
+            row = conn.execute(sql, (user_id, specialization_id)).fetchone()
+        if row is None:
+            return False # Profile already exists for this user
+        _invalidate_departments_cache() # doctor_count per department changed
+        _cached_available_doctors.cache_clear() # new doctor joins the search results
         return True
-    except sqlite3.IntegrityError:
-        return False
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
 
 # --- DOCTOR AVAILABILITY FUNCTIONS ---
 
+# Bumped whenever availability or bookings change, so the availability API can
+# build cheap ETags that stay valid exactly as long as the slot data does.
+_slots_version = 0
+
+def get_slots_version():
+    """Returns the current version of the availability/booking data."""
+    return _slots_version
+
+def _bump_slots_version():
+    global _slots_version
+    _slots_version += 1
+
 def set_doctor_availability(doctor_id, date, start_time, end_time):
     """Sets a specific time slot for a doctor."""
     conn = get_db_connection()
     try:
-        conn.execute(
-            """INSERT INTO doctor_availability (doctor_id, date, start_time, end_time) 
-               VALUES (?, ?, ?, ?)""",
-            (doctor_id, date, start_time, end_time)
-        )
-        conn.commit()
+        with _write_lock, conn:
+            row = conn.execute(
+                """INSERT INTO doctor_availability (doctor_id, date, start_time, end_time)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(doctor_id, date, start_time) DO NOTHING
+                   RETURNING id""",
+                (doctor_id, date, start_time, end_time)
+            ).fetchone()
+        if row is None:
+            # Duplicate slot (UNIQUE constraint)
+            return False
+        _bump_slots_version()
         return True
-    except sqlite3.IntegrityError:
-        # Prevents duplicate slots (UNIQUE constraint)
-        return False
     finally:
         conn.close()
 
-def get_doctor_availability(doctor_id, start_date, end_date):
-    """Fetches availability slots for a doctor within a date range."""
+def set_doctor_availability_bulk(slots):
+    """Sets many (doctor_id, date, start_time, end_time) slots in one transaction.
+
+    Meant for seeding whole schedules: one commit for the batch instead of an
+    fsync per slot. Already-existing slots are skipped. Returns the number of
+    slots inserted."""
     conn = get_db_connection()
+    try:
+        with _write_lock, conn:
+            cursor = conn.executemany(
+                """INSERT OR IGNORE INTO doctor_availability (doctor_id, date, start_time, end_time)
+                   VALUES (?, ?, ?, ?)""",
+                slots
+            )
+            inserted = cursor.rowcount
+        if inserted:
+            _bump_slots_version()
+        return inserted
+    finally:
+        conn.close()
+
+def get_doctor_availability(doctor_id, start_date, end_date, conn=None):
+    """Fetches availability slots for a doctor within a date range.
+
+    Callers already holding a connection can pass it in so the whole
+    request stays on one connection instead of borrowing a second one."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     # Note: We order by date and time for clean display
     availability = conn.execute(
-        """SELECT date, start_time, end_time FROM doctor_availability 
-           WHERE doctor_id = ? AND date BETWEEN ? AND ? 
+        """SELECT date, start_time, end_time FROM doctor_availability
+           WHERE doctor_id = ? AND date BETWEEN ? AND ?
            ORDER BY date, start_time""",
         (doctor_id, start_date, end_date)
     ).fetchall()
-    conn.close()
+    if own_conn:
+        conn.close()
     return availability
 
+# --- ROW TYPES FOR TEMPLATE LOOPS ---
+# Slots-based dataclasses for rows rendered in template loops: an attribute
+# read is a single slot lookup, where sqlite3.Row does a linear scan over the
+# column names on every access (N rows x K columns per render). Jinja's
+# subscript syntax falls back to attributes, so templates need no changes.
+
+@dataclass(slots=True)
+class PatientAppointmentRow:
+    appt_id: int
+    date: str
+    time: str
+    status: str
+    doctor_name: str
+    specialization: str
+    # Only rendered for history entries; upcoming queries skip the
+    # treatments join and leave these at None
+    diagnosis: str = None
+    prescription: str = None
+
+@dataclass(slots=True)
+class DoctorAppointmentRow:
+    id: int
+    date: str
+    time: str
+    patient_name: str
+    contact_info: str
+
+@dataclass(slots=True)
+class PatientRow:
+    id: int
+    name: str
+    contact_info: str
+
+@dataclass(slots=True)
+class DoctorRow:
+    id: int
+    name: str
+    username: str
+    contact_info: str
+    specialization: str
+
 # --- NEW PATIENT BOOKING FUNCTIONS ---
 
+# Whether the users_fts full-text index exists (None = not probed yet).
+# Builds without FTS5 simply never create the table and fall back to LIKE.
+_fts_available = None
+
+def _tuple_cursor(conn):
+    """Cursor that yields plain tuples instead of sqlite3.Row.
+
+    The pool sets row_factory = sqlite3.Row connection-wide for the named
+    access templates rely on, but the hottest reads below only unpack rows
+    positionally - into a list of scalars or a dataclass. Overriding the
+    factory on a per-cursor basis skips one Row allocation per result row
+    at zero cost to the callers."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+def _fts_enabled(conn):
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = conn.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'users_fts'"
+        ).fetchone() is not None
+    return _fts_available
+
+# The doctor roster changes on the order of days but is queried on every
+# booking page load, so search results are cached per (filters, epoch).
+# Folding a rolling epoch into the lru_cache key gives a TTL without any
+# expiry bookkeeping: after DOCTOR_SEARCH_CACHE_TTL seconds the epoch
+# advances, the old entries stop being hit, and the LRU evicts them.
+DOCTOR_SEARCH_CACHE_TTL = 60
+
+@lru_cache(maxsize=128)
+def _cached_available_doctors(specialization_id, name_query, epoch):
+    return _query_available_doctors(specialization_id, name_query)
+
 def get_available_doctors(specialization_id=None, name_query=None):
-    """Fetches doctors filtered by specialization or name."""
+    """Fetches doctors filtered by specialization or name.
+
+    Results are served from a short-lived in-process cache; writes that
+    change the roster (add_doctor_profile) clear it explicitly."""
+    epoch = int(time.monotonic() // DOCTOR_SEARCH_CACHE_TTL)
+    return _cached_available_doctors(specialization_id, name_query, epoch)
+
+# All doctor-search query variants, enumerated at import time instead of
+# concatenated per call: every call then hands the statement cache one of a
+# fixed set of strings, so each variant is parsed and planned once per
+# pooled connection. Keyed by (specialization filter?, name filter mode) -
+# the name filter has an FTS and a LIKE spelling because users_fts only
+# exists on FTS5-capable builds.
+_DOCTOR_SEARCH_BASE = """
+    SELECT
+        u.id, u.name, u.contact_info, d.name AS specialization
+    FROM users u
+    JOIN doctors doc ON u.id = doc.user_id
+    JOIN departments d ON doc.specialization_id = d.id
+    WHERE u.role = 'Doctor' AND u.is_active = 1
+"""
+_DOCTOR_SPEC_FILTER = " AND d.id = ?"
+# Phrase-prefix search over the FTS index instead of a LIKE scan of the
+# whole users table
+_DOCTOR_NAME_FTS = " AND u.id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)"
+_DOCTOR_NAME_LIKE = " AND u.name LIKE ?"
+_DOCTOR_ORDER = " ORDER BY u.name"
+
+_DOCTOR_QUERIES = {
+    (False, None):   _DOCTOR_SEARCH_BASE + _DOCTOR_ORDER,
+    (True, None):    _DOCTOR_SEARCH_BASE + _DOCTOR_SPEC_FILTER + _DOCTOR_ORDER,
+    (False, 'fts'):  _DOCTOR_SEARCH_BASE + _DOCTOR_NAME_FTS + _DOCTOR_ORDER,
+    (True, 'fts'):   _DOCTOR_SEARCH_BASE + _DOCTOR_SPEC_FILTER + _DOCTOR_NAME_FTS + _DOCTOR_ORDER,
+    (False, 'like'): _DOCTOR_SEARCH_BASE + _DOCTOR_NAME_LIKE + _DOCTOR_ORDER,
+    (True, 'like'):  _DOCTOR_SEARCH_BASE + _DOCTOR_SPEC_FILTER + _DOCTOR_NAME_LIKE + _DOCTOR_ORDER,
+}
+
+def _query_available_doctors(specialization_id, name_query):
     conn = get_db_connection()
-    query = """
-        SELECT 
-            u.id, u.name, u.contact_info, d.name AS specialization 
-        FROM users u
-        JOIN doctors doc ON u.id = doc.user_id
-        JOIN departments d ON doc.specialization_id = d.id
-        WHERE u.role = 'Doctor' AND u.is_active = 1
-    """
-    params = []
 
+    params = []
     if specialization_id:
-        query += " AND d.id = ?"
         params.append(specialization_id)
-    
+
+    name_mode = None
     if name_query:
-        # Simple LIKE search for doctor name
-        query += " AND u.name LIKE ?"
-        params.append(f"%{name_query}%")
-        
-    query += " ORDER BY u.name"
-    
-    doctors = conn.execute(query, tuple(params)).fetchall()
+        if _fts_enabled(conn):
+            name_mode = 'fts'
+            params.append('"' + name_query.replace('"', '""') + '"*')
+        else:
+            name_mode = 'like'
+            params.append(f"%{name_query}%")
+
+    query = _DOCTOR_QUERIES[(bool(specialization_id), name_mode)]
+    doctors = conn.execute(query, params).fetchall()
     conn.close()
     return doctors
 
@@ -145,155 +486,318 @@ def get_doctor_availability_by_date(doctor_id, date_str):
     """
     Finds available time slots for a specific doctor on a specific date.
     This also accounts for already booked appointments.
+
+    Implemented as a single anti-join: SQLite filters out booked times in
+    one pass over the two UNIQUE indexes, instead of two round trips plus
+    a Python-side set difference. (An EXCEPT of the two selects would also
+    work, but it adds a distinct/merge step and repeats the bind params;
+    the anti-join expresses the booked-status condition directly.)
     """
     conn = get_db_connection()
-    
-    # 1. Get all scheduled availability slots for the doctor on that date
-    available_slots = conn.execute(
-        "SELECT start_time FROM doctor_availability WHERE doctor_id = ? AND date = ?",
-        (doctor_id, date_str)
-    ).fetchall()
-    
-    # 2. Get all currently booked appointments for the doctor on that date
-    booked_times = conn.execute(
-        "SELECT time FROM appointments WHERE doctor_id = ? AND date = ? AND status = 'Booked'",
+    rows = _tuple_cursor(conn).execute(
+        """SELECT a.start_time
+           FROM doctor_availability a
+           LEFT JOIN appointments b
+                ON b.doctor_id = a.doctor_id
+                AND b.date = a.date
+                AND b.time = a.start_time
+                AND b.status = 'Booked'
+           WHERE a.doctor_id = ? AND a.date = ? AND b.time IS NULL
+           ORDER BY a.start_time""",
         (doctor_id, date_str)
     ).fetchall()
-    
-    booked_times = {t['time'] for t in booked_times}
-    
-    # 3. Filter available slots to remove booked times
-    open_slots = [
-        slot['start_time'] for slot in available_slots 
-        if slot['start_time'] not in booked_times
-    ]
-
     conn.close()
-    return open_slots
+    return [row[0] for row in rows]
 
 def create_appointment(patient_id, doctor_id, date_str, time):
     """Creates a new 'Booked' appointment."""
     conn = get_db_connection()
     
-    # Basic check to prevent double booking, although a UNIQUE constraint exists
+    # The UNIQUE(doctor_id, date, time) constraint rejects double bookings;
+    # DO NOTHING RETURNING surfaces that as an empty result instead of an
+    # IntegrityError to raise and unwind
     try:
-        conn.execute(
-            """INSERT INTO appointments (patient_id, doctor_id, date, time, status)
-               VALUES (?, ?, ?, ?, 'Booked')""",
-            (patient_id, doctor_id, date_str, time)
-        )
-        conn.commit()
+        with _write_lock, conn:
+            row = conn.execute(
+                """INSERT INTO appointments (patient_id, doctor_id, date, time, status)
+                   VALUES (?, ?, ?, ?, 'Booked')
+                   ON CONFLICT(doctor_id, date, time) DO NOTHING
+                   RETURNING id""",
+                (patient_id, doctor_id, date_str, time)
+            ).fetchone()
+        if row is None:
+            return False # Doctor is already booked at this time
+        _bump_slots_version()
         return True
-    except sqlite3.IntegrityError:
-        return False # Doctor is already booked at this time
     finally:
         conn.close()
 
-def get_patient_appointments(patient_id):
-    """Fetches all past, upcoming, and cancelled appointments for a patient."""
+# The patient-appointment queries read from the patient_appointments_v view
+# (defined in init_db), which names the 4-way join once in the schema instead
+# of in every SQL string here. SQLite flattens the view into the outer query,
+# so the plan is identical to writing the join inline; keeping the SQL in
+# module-level constants means every call presents the per-connection
+# statement cache with the exact same string, so each query is parsed and
+# planned once per pooled connection.
+_SQL_PATIENT_ALL = """
+    SELECT appt_id, date, time, status, doctor_name, specialization,
+           diagnosis, prescription
+    FROM patient_appointments_v
+    WHERE patient_id = ?
+    ORDER BY date DESC, time DESC
+"""
+
+# Upcoming appointments never render diagnosis/prescription, so this variant
+# drops the treatments LEFT JOIN — the most expensive join in the query —
+# and the two columns that came from it
+_SQL_PATIENT_UPCOMING = """
+    SELECT
+        a.id AS appt_id, a.date, a.time, a.status,
+        u_doc.name AS doctor_name,
+        d.name AS specialization
+    FROM appointments a
+    JOIN users u_doc ON a.doctor_id = u_doc.id
+    JOIN doctors doc ON u_doc.id = doc.user_id
+    JOIN departments d ON doc.specialization_id = d.id
+    WHERE a.patient_id = ? AND a.status = 'Booked' AND a.date >= ?
+    ORDER BY a.date, a.time
+"""
+
+_SQL_PATIENT_HISTORY = """
+    SELECT appt_id, date, time, status, doctor_name, specialization,
+           diagnosis, prescription
+    FROM patient_appointments_v
+    WHERE patient_id = ? AND NOT (status = 'Booked' AND date >= ?)
+    ORDER BY date DESC, time DESC
+"""
+
+def get_patient_appointments(patient_id, batch_size=100):
+    """Yields all past, upcoming, and cancelled appointments for a patient.
+
+    Streams rows in fetchmany(batch_size) chunks instead of materializing
+    the whole history with fetchall(), so peak memory stays bounded for
+    long-lived patient records and callers can render or serialize rows as
+    they arrive. The connection goes back to the pool when the generator is
+    exhausted or closed (templates iterate exactly once, so this holds)."""
     conn = get_db_connection()
-    
-    appointments = conn.execute("""
-        SELECT 
-            a.id AS appt_id, a.date, a.time, a.status,
-            u_doc.name AS doctor_name,
-            d.name AS specialization,
-            t.diagnosis, t.prescription
-        FROM appointments a
-        JOIN users u_doc ON a.doctor_id = u_doc.id
-        JOIN doctors doc ON u_doc.id = doc.user_id
-        JOIN departments d ON doc.specialization_id = d.id
-        LEFT JOIN treatments t ON a.id = t.appointment_id
-        WHERE a.patient_id = ?
-        ORDER BY a.date DESC, a.time DESC
-    """, (patient_id,)).fetchall()
-    
+    try:
+        cursor = conn.execute(_SQL_PATIENT_ALL, (patient_id,))
+        while True:
+            chunk = cursor.fetchmany(batch_size)
+            if not chunk:
+                break
+            yield from chunk
+    finally:
+        conn.close()
+
+def get_patient_upcoming(patient_id, today):
+    """Fetches a patient's booked appointments from today onward."""
+    conn = get_db_connection()
+    rows = [PatientAppointmentRow(*row) for row in _tuple_cursor(conn).execute(_SQL_PATIENT_UPCOMING, (patient_id, today))]
+    conn.close()
+    return rows
+
+def get_patient_history(patient_id, today):
+    """Fetches a patient's past, completed, and cancelled appointments."""
+    conn = get_db_connection()
+    rows = [PatientAppointmentRow(*row) for row in _tuple_cursor(conn).execute(_SQL_PATIENT_HISTORY, (patient_id, today))]
     conn.close()
-    return appointments
+    return rows
 
 
 # --- DB INIT (Rest of the file remains the same) ---
+# Dates are stored as ISO-8601 TEXT (YYYY-MM-DD) on purpose: lexicographic
+# order equals chronological order, so every `date >= ?` comparison and index
+# range scan below is already correct, and the stored value doubles as the
+# display format in the templates. Integer day-ordinals would shave a couple
+# of bytes per index entry but would need a rebuild of existing databases and
+# a render-time conversion for no measurable win at this data size.
+# The whole schema as one SQL script: executescript pushes it through the
+# parser in a single call, and the explicit BEGIN/COMMIT makes all the DDL
+# atomic with one fsync at the end - noticeably quicker on first run and on
+# every startup re-init. All statements are IF NOT EXISTS / idempotent.
+SCHEMA_SQL = """
+-- 1. Users (Admin, Doctor, Patient; is_active is used for blacklisting)
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    role TEXT NOT NULL, -- 'Admin', 'Doctor', 'Patient'
+    name TEXT,
+    contact_info TEXT,
+    is_active BOOLEAN DEFAULT 1
+);
+
+-- Index so the admin dashboard's per-role counts are index-only scans
+CREATE INDEX IF NOT EXISTS idx_users_role ON users (role);
+
+-- 2. Departments (specializations); doctor_count is maintained by the
+--    doctors_* triggers below
+CREATE TABLE IF NOT EXISTS departments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT,
+    doctor_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- 3. Doctors (doctor profile)
+CREATE TABLE IF NOT EXISTS doctors (
+    user_id INTEGER PRIMARY KEY,
+    specialization_id INTEGER,
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (specialization_id) REFERENCES departments (id)
+);
+
+-- Keep departments.doctor_count in step with the doctors table, so
+-- get_departments reads a stored value instead of re-running a
+-- LEFT JOIN ... GROUP BY aggregation on every call
+CREATE TRIGGER IF NOT EXISTS doctors_ai AFTER INSERT ON doctors BEGIN
+    UPDATE departments SET doctor_count = doctor_count + 1 WHERE id = NEW.specialization_id;
+END;
+CREATE TRIGGER IF NOT EXISTS doctors_ad AFTER DELETE ON doctors BEGIN
+    UPDATE departments SET doctor_count = doctor_count - 1 WHERE id = OLD.specialization_id;
+END;
+CREATE TRIGGER IF NOT EXISTS doctors_au AFTER UPDATE OF specialization_id ON doctors BEGIN
+    UPDATE departments SET doctor_count = doctor_count - 1 WHERE id = OLD.specialization_id;
+    UPDATE departments SET doctor_count = doctor_count + 1 WHERE id = NEW.specialization_id;
+END;
+
+-- Recompute the counts once (cheap, idempotent): corrects rows written
+-- before the triggers existed
+UPDATE departments SET doctor_count =
+    (SELECT COUNT(*) FROM doctors WHERE specialization_id = departments.id)
+WHERE doctor_count !=
+    (SELECT COUNT(*) FROM doctors WHERE specialization_id = departments.id);
+
+-- 4. DoctorAvailability (doctor_id references users for consistency)
+CREATE TABLE IF NOT EXISTS doctor_availability (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doctor_id INTEGER NOT NULL,
+    date TEXT NOT NULL, -- YYYY-MM-DD
+    start_time TEXT NOT NULL, -- HH:MM
+    end_time TEXT NOT NULL,   -- HH:MM
+    UNIQUE(doctor_id, date, start_time),
+    FOREIGN KEY (doctor_id) REFERENCES users (id)
+);
+
+-- 5. Appointments
+CREATE TABLE IF NOT EXISTS appointments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id INTEGER NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    date TEXT NOT NULL, -- YYYY-MM-DD
+    time TEXT NOT NULL, -- HH:MM
+    status TEXT NOT NULL, -- 'Booked', 'Completed', 'Cancelled'
+    UNIQUE(doctor_id, date, time),
+    FOREIGN KEY (patient_id) REFERENCES users (id),
+    FOREIGN KEY (doctor_id) REFERENCES users (id)
+);
+
+-- Index so the dashboard's upcoming/history range scans don't walk the table
+CREATE INDEX IF NOT EXISTS idx_appt_patient_date ON appointments (patient_id, date);
+
+-- Indexes for the doctor dashboard's upcoming-appointments range scan and
+-- its distinct-patients aggregation
+CREATE INDEX IF NOT EXISTS idx_appt_doctor_date ON appointments (doctor_id, date);
+CREATE INDEX IF NOT EXISTS idx_appt_doctor_patient ON appointments (doctor_id, patient_id);
+
+-- 6. Treatments (medical records)
+CREATE TABLE IF NOT EXISTS treatments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    appointment_id INTEGER NOT NULL,
+    diagnosis TEXT,
+    prescription TEXT,
+    notes TEXT,
+    date_recorded TEXT,
+    FOREIGN KEY (appointment_id) REFERENCES appointments (id)
+);
+
+-- Lookup indexes for the remaining joins: treatments by appointment (the
+-- LEFT JOIN in every patient history query) and doctors by specialization.
+-- The (doctor_id, date, ...) shapes are already covered by the UNIQUE
+-- constraints above, which SQLite implements as indexes.
+CREATE INDEX IF NOT EXISTS idx_treat_appt ON treatments (appointment_id);
+CREATE INDEX IF NOT EXISTS idx_doctors_spec ON doctors (specialization_id);
+
+-- Read model for the patient dashboard: the appointment/doctor/department/
+-- treatment join written down once. SQLite flattens the view into each
+-- query, so reads cost the same as the inline join; a materialized cache
+-- table with sync triggers would be the next step if this ever shows up in
+-- profiles, but at this data volume the flattened join is already a handful
+-- of index lookups per row.
+CREATE VIEW IF NOT EXISTS patient_appointments_v AS
+SELECT
+    a.patient_id,
+    a.id AS appt_id, a.date, a.time, a.status,
+    u_doc.name AS doctor_name,
+    d.name AS specialization,
+    t.diagnosis, t.prescription
+FROM appointments a
+JOIN users u_doc ON a.doctor_id = u_doc.id
+JOIN doctors doc ON u_doc.id = doc.user_id
+JOIN departments d ON doc.specialization_id = d.id
+LEFT JOIN treatments t ON a.id = t.appointment_id;
+"""
+
+# Full-text index over user names for the doctor search: the UI's substring
+# query cannot use a B-tree index, but FTS5 answers prefix matches from its
+# token index. External-content table, kept in sync by triggers. Kept out of
+# SCHEMA_SQL because it must be skippable as a unit (with a LIKE fallback at
+# query time) on SQLite builds without FTS5.
+FTS_SCHEMA_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(name, content='users', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS users_ai AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS users_ad AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts(users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS users_au AFTER UPDATE OF name ON users BEGIN
+    INSERT INTO users_fts(users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO users_fts(rowid, name) VALUES (new.id, new.name);
+END;
+-- Rebuild picks up rows that existed before the triggers did
+INSERT INTO users_fts(users_fts) VALUES('rebuild');
+"""
+
 def init_db():
     """Initializes the database by creating tables and seeding the Admin user."""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # --- 1. Users Table (Handles Admin, Doctor, Patient) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL, -- 'Admin', 'Doctor', 'Patient'
-            name TEXT,
-            contact_info TEXT,
-            is_active BOOLEAN DEFAULT 1 -- Used for blacklisting/removing users
-        );
-    ''')
-
-    # --- 2. Departments Table (Specializations) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS departments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            description TEXT
-        );
-    ''')
-
-    # --- 3. Doctors Table (Doctor Profile) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS doctors (
-            user_id INTEGER PRIMARY KEY,
-            specialization_id INTEGER,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (specialization_id) REFERENCES departments (id)
-        );
-    ''')
-
-    # --- 4. DoctorAvailability Table (Availability for Appointments) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS doctor_availability (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            doctor_id INTEGER NOT NULL,
-            date TEXT NOT NULL, -- YYYY-MM-DD
-            start_time TEXT NOT NULL, -- HH:MM
-            end_time TEXT NOT NULL,   -- HH:MM
-            UNIQUE(doctor_id, date, start_time),
-            FOREIGN KEY (doctor_id) REFERENCES users (id) -- Changed to users for consistency
-        );
-    ''')
-
-    # --- 5. Appointments Table ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS appointments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id INTEGER NOT NULL,
-            doctor_id INTEGER NOT NULL,
-            date TEXT NOT NULL, -- YYYY-MM-DD
-            time TEXT NOT NULL, -- HH:MM
-            status TEXT NOT NULL, -- 'Booked', 'Completed', 'Cancelled'
-            UNIQUE(doctor_id, date, time),
-            FOREIGN KEY (patient_id) REFERENCES users (id),
-            FOREIGN KEY (doctor_id) REFERENCES users (id)
-        );
-    ''')
-
-    # --- 6. Treatments Table (Medical Records) ---
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS treatments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            appointment_id INTEGER NOT NULL,
-            diagnosis TEXT,
-            prescription TEXT,
-            notes TEXT,
-            date_recorded TEXT,
-            FOREIGN KEY (appointment_id) REFERENCES appointments (id)
-        );
-    ''')
+    # journal_mode=WAL is a persistent property of the database file (unlike
+    # the other PRAGMAs, which are per-connection and set by the pool), so
+    # pinning it here means even ad-hoc connections from scripts or the
+    # sqlite3 CLI get WAL behavior
+    cursor.execute('PRAGMA journal_mode=WAL;')
+
+    # Migration for databases created before the doctor_count column: must
+    # run before SCHEMA_SQL so the doctors_* triggers (which reference the
+    # column) can be created. On a fresh database the table doesn't exist
+    # yet and this no-ops; SCHEMA_SQL then creates it with the column.
+    try:
+        cursor.execute('ALTER TABLE departments ADD COLUMN doctor_count INTEGER NOT NULL DEFAULT 0;')
+    except sqlite3.OperationalError:
+        pass # Column already present, or fresh database
+
+    # One parse, one atomic transaction, one fsync for the whole schema
+    conn.executescript("BEGIN;\n" + SCHEMA_SQL + "\nCOMMIT;")
+
+    try:
+        conn.executescript("BEGIN;\n" + FTS_SCHEMA_SQL + "\nCOMMIT;")
+    except sqlite3.OperationalError:
+        pass # This SQLite build lacks FTS5
+
+    # Refresh planner statistics so the covering indexes above actually get
+    # picked once tables have data (cheap and idempotent at this scale)
+    cursor.execute('ANALYZE;')
 
     conn.commit()
     conn.close()
 
+    print(f"SHA-256 backend: {SHA256_BACKEND}" + (
+        "" if SHA256_BACKEND == 'openssl' else " (OpenSSL not available - hashing will be slow)"))
+
 def add_admin():
     """Programmatically creates the pre-existing Admin user if they do not exist."""
     conn = get_db_connection()
@@ -304,21 +808,18 @@ def add_admin():
     hashed_pass = hash_password(ADMIN_PASSWORD)
 
     try:
-        cursor.execute("SELECT id FROM users WHERE username = ?", (ADMIN_USERNAME,))
-        if cursor.fetchone() is None:
-            # Insert the pre-existing Admin user
-            cursor.execute(
-                "INSERT INTO users (username, password_hash, role, name) VALUES (?, ?, ?, ?)",
-                (ADMIN_USERNAME, hashed_pass, 'Admin', 'System Administrator')
-            )
-            print(f"Admin user '{ADMIN_USERNAME}' created with password: {ADMIN_PASSWORD}")
-            conn.commit()
-        else:
+        # One atomic statement against the UNIQUE(username) constraint
+        # replaces the old SELECT-then-INSERT plus IntegrityError handler;
+        # rowcount says whether the row actually went in
+        cursor.execute(
+            "INSERT OR IGNORE INTO users (username, password_hash, role, name) VALUES (?, ?, ?, ?)",
+            (ADMIN_USERNAME, hashed_pass, 'Admin', 'System Administrator')
+        )
+        conn.commit()
+        if cursor.rowcount == 0:
             print(f"Admin user '{ADMIN_USERNAME}' already exists.")
-
-    except sqlite3.IntegrityError as e:
-        # Handles case where another process might have inserted the admin
-        print(f"Integrity Error while adding admin: {e}")
+        else:
+            print(f"Admin user '{ADMIN_USERNAME}' created with password: {ADMIN_PASSWORD}")
     finally:
         conn.close()
 